@@ -1,11 +1,33 @@
-from flask import Flask, request, jsonify, render_template, send_file, abort, redirect, url_for
+from flask import Flask, Response, request, has_request_context, jsonify, render_template, send_from_directory, abort, redirect, url_for
 import base64
 import socket
 import os
+import re
+import sys
+import io
+import csv
+import math
+import functools
+import gzip
 import json
-from datetime import datetime
+import zlib
+import time
+import hmac
+import cProfile
+import ctypes
+import ctypes.util
+import struct
+import threading
+from collections import Counter, OrderedDict, deque
+import urllib.error
+import urllib.request
+from urllib.parse import parse_qs, quote, urlencode, urlparse
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
 import logging
 import uuid
+from jinja2 import FileSystemBytecodeCache
+from werkzeug.serving import make_server
 
 app = Flask(__name__)
 
@@ -17,14 +39,67 @@ logging.basicConfig(level=logging.INFO,
 
 # Configuration
 KEY_PATH = "rustdesk_config.txt"  # Path to your RustDesk public key
+HBBS_KEY_PATH = "/opt/rustdesk/id_ed25519.pub"  # hbbs public key; KEY_PATH is updated when it changes
 CLIENTS_FILE = "clients.json"  # File to store client information
-TEMPLATE_DIR = "templates"  # Directory for HTML templates
+TEMPLATE_DIR = "templates"  # Directory for HTML templates, deployed alongside this script
+TEMPLATE_CACHE_DIR = "template_cache"  # Compiled template bytecode, reused across restarts
+IMPORT_CHUNK_SIZE = 500  # Records upserted per save during /api/import
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+EXPORT_FIELDS = ["client_id", "hostname", "ip_address", "os", "notes", "connection_string",
+                 "registered_at", "last_seen", "manually_added", "tags"]  # CSV columns; tags are ;-joined
+
+BULK_ACTIONS = ("delete", "tag", "notes")
+EXTRA_FIELDS_MAX = 16  # Unrecognized /register fields kept per client; the rest are dropped
+FEDERATION_PEERS_FILE = "peers.json"  # Optional list of peer address books to aggregate
+FEDERATION_LOCAL_NAME = socket.gethostname()  # Range label for this instance's own clients
+FEDERATION_TTL = 30  # Seconds a peer's registry is reused before revalidating
+FEDERATION_TIMEOUT = 5  # Per-peer HTTP timeout in seconds
+FEDERATION_DEADLINE = 2  # Max seconds the aggregated view waits on peers before serving cached data
+FEDERATION_BACKOFF_MAX = 300  # Cap in seconds on the retry delay for failing peers
+PROFILE_TOKEN = os.environ.get("RUSTDESK_PROFILE_TOKEN", "")  # Profiling is disabled unless set
+PROFILE_DIR = "profiles"  # Where request and sampling profiles are written
+PROFILE_MAX_FILES = 20  # Oldest profiles are removed beyond this many
+PROFILE_SAMPLE_INTERVAL = 0.01  # Seconds between stack samples in sampling mode
+PROFILE_SAMPLE_MAX_SECONDS = 600  # Longest sampling run that can be requested
+REGISTER_MAX_BYTES = 64 * 1024  # Largest /register body accepted
+IMPORT_MAX_BYTES = 256 * 1024 * 1024  # Largest /api/import upload, and the cap on any request body
+RATE_LIMIT_PER_SECOND = 2.0  # Sustained write requests per source IP
+RATE_LIMIT_BURST = 20  # Write requests a source IP may send back to back
+RATE_LIMIT_MAX_SOURCES = 10000  # Source IPs tracked before idle buckets are pruned
+MAX_INFLIGHT_WRITES = 8  # Concurrent write requests before new ones get 503
+OVERLOAD_RETRY_AFTER = 1  # Seconds clients are told to wait after a 503
+HISTORY_PER_CLIENT = 20  # Changes remembered in memory per client
+HISTORY_MAX_CLIENTS = 10000  # Clients with in-memory history before the least recently changed are forgotten
+AUDIT_DIR = "audit"  # Append-only NDJSON log of every change
+AUDIT_SEGMENT_BYTES = 1024 * 1024  # Audit segments are gzipped and a new one started past this size
+AUDIT_MAX_SEGMENTS = 50  # Oldest compressed audit segments are removed beyond this many
+AUDIT_PAGE_MAX = 1000  # Largest page /api/audit returns
+CONFIG_POLL_INTERVAL = 2  # Seconds between mtime checks of the key files when inotify is unavailable
+EVENT_KEEPALIVE = 15  # Seconds between keepalive comments on idle /events streams
+RENDERED_CONFIG_MAX = 256  # Distinct server addresses whose rendered config is cached
+
+app.config["MAX_CONTENT_LENGTH"] = IMPORT_MAX_BYTES
+app.template_folder = TEMPLATE_DIR
+app.jinja_options = {**app.jinja_options, "bytecode_cache": FileSystemBytecodeCache(TEMPLATE_CACHE_DIR)}
+
+# Serializes read-modify-write cycles on the clients file
+clients_lock = threading.Lock()
+
+# Parsed clients file as ClientRecords, keyed by its (mtime, size, inode)
+_clients_cache = (None, ())
+
+# client_id -> deque of (epoch, action, source, before, after) with ClientRecords or None
+client_history = OrderedDict()
+audit_lock = threading.Lock()
+audit_segment = None  # Name (without extension) of the audit segment being appended to
 
 # Initialize clients file if it doesn't exist
 if not os.path.exists(CLIENTS_FILE):
     with open(CLIENTS_FILE, 'w') as f:
         json.dump([], f)
 
+os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+
 def get_local_ip():
     """Get the local IP of the system"""
     with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
@@ -35,12 +110,9 @@ def get_local_ip():
             local_ip = "127.0.0.1"
     return local_ip
 
-def convert_rustdesk_config(filepath):
-    """Read rustdesk string from a file, convert to JSON format with local IP"""
-    with open(filepath, 'r') as file:
-        original = file.read().strip()  # read and remove surrounding whitespace/newlines
-
-    local_ip = get_local_ip()
+def convert_rustdesk_config(original, local_ip=None):
+    """Convert a rustdesk config string to the encoded JSON format with local IP"""
+    local_ip = local_ip or get_local_ip()
 
     # Parse original config into dictionary
     fields = {}
@@ -66,36 +138,865 @@ def convert_rustdesk_config(filepath):
     return reversed_result
 
 
-def load_clients():
-    """Load clients from the JSON file."""
+def _to_epoch(value):
+    """Parse an isoformat timestamp to epoch seconds, or None if it isn't one."""
+    if not isinstance(value, str):
+        return None
+    try:
+        return int(datetime.fromisoformat(value).timestamp())
+    except ValueError:
+        return None
+
+def _from_epoch(ts):
+    return datetime.fromtimestamp(ts).isoformat() if ts is not None else ''
+
+class ClientRecord:
+    """Compact in-memory form of one client.
+
+    Known fields live in slots, timestamps are epoch seconds and the OS and tag
+    strings are interned since most ranges share a handful of them. Any other
+    keys sent to /register go in a small side map. Convert with from_dict and
+    to_dict only where clients enter or leave as JSON.
+    """
+    __slots__ = ("client_id", "hostname", "ip_address", "os", "notes", "connection_string",
+                 "registered_ts", "last_seen_ts", "manually_added", "tags", "extra")
+    TEXT_FIELDS = ("client_id", "hostname", "ip_address", "os", "notes", "connection_string")
+    
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, None)
+    
+    @classmethod
+    def from_dict(cls, data):
+        record = cls()
+        extra = {}
+        dropped = 0
+        for key, value in data.items():
+            if key in cls.TEXT_FIELDS:
+                setattr(record, key, value)
+            elif key == 'registered_at' and _to_epoch(value) is not None:
+                record.registered_ts = _to_epoch(value)
+            elif key == 'last_seen' and _to_epoch(value) is not None:
+                record.last_seen_ts = _to_epoch(value)
+            elif key == 'manually_added' and isinstance(value, bool):
+                record.manually_added = value
+            elif key == 'tags' and isinstance(value, list) and all(isinstance(t, str) for t in value):
+                record.tags = tuple(sys.intern(t) for t in value)
+            elif len(extra) < EXTRA_FIELDS_MAX:
+                extra[sys.intern(key)] = value
+            else:
+                dropped += 1
+        if isinstance(record.os, str):
+            record.os = sys.intern(record.os)
+        record.extra = extra or None
+        if dropped:
+            app.logger.warning(f"Dropped {dropped} extra field(s) from client {record.client_id}")
+        return record
+    
+    def __eq__(self, other):
+        if not isinstance(other, ClientRecord):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+    
+    def to_dict(self):
+        data = {}
+        for name in self.TEXT_FIELDS:
+            value = getattr(self, name)
+            if value is not None:
+                data[name] = value
+        if self.registered_ts is not None:
+            data["registered_at"] = self.registered_at
+        if self.last_seen_ts is not None:
+            data["last_seen"] = self.last_seen
+        if self.manually_added is not None:
+            data["manually_added"] = self.manually_added
+        if self.tags is not None:
+            data["tags"] = list(self.tags)
+        if self.extra:
+            data.update(self.extra)
+        return data
+    
+    # Same isoformat strings the templates and JSON consumers already expect
+    @property
+    def registered_at(self):
+        return _from_epoch(self.registered_ts)
+    
+    @property
+    def last_seen(self):
+        return _from_epoch(self.last_seen_ts)
+
+# (version, raw KEY_PATH text, encoded paste string); replaced whole on reload
+server_config = (0, None, None)
+config_changed = threading.Condition()
+config_listeners = []  # Called with no arguments, from the watcher thread, after each config change
+
+def reload_server_config():
+    """Re-read KEY_PATH and the hbbs key, and swap in a new encoded config if either changed.
+
+    A new hbbs key is written into KEY_PATH's key= field so clients fetching
+    /rustdesk_config.txt get it too. Returns True if the config changed.
+    """
+    global server_config
+    try:
+        with open(KEY_PATH, 'r') as f:
+            raw = f.read().strip()
+    except FileNotFoundError:
+        raw = None
+    try:
+        with open(HBBS_KEY_PATH, 'r') as f:
+            hbbs_key = f.read().strip()
+    except FileNotFoundError:
+        hbbs_key = None
+    
+    if hbbs_key:
+        if raw is None:
+            updated = f"rustdesk-host=serverip,key={hbbs_key},relay=serverip"
+        else:
+            updated = ','.join(f"key={hbbs_key}" if item.startswith('key=') else item for item in raw.split(','))
+        if updated != raw:
+            tmp_path = KEY_PATH + '.tmp'
+            try:
+                with open(tmp_path, 'w') as f:
+                    f.write(updated)
+                os.replace(tmp_path, KEY_PATH)
+                app.logger.info("Updated RustDesk config with new hbbs key")
+            except OSError as e:
+                # Still serve the new key from memory
+                app.logger.error(f"Failed to write {KEY_PATH}: {str(e)}")
+            raw = updated
+    
+    with config_changed:
+        if raw == server_config[1]:
+            return False
+        server_config = (server_config[0] + 1, raw, convert_rustdesk_config(raw) if raw is not None else None)
+        config_changed.notify_all()
+    for listener in config_listeners:
+        listener()
+    app.logger.info("Loaded RustDesk server config")
+    return True
+
+# (config version, {server address: (config, encoded)}); replaced when the config reloads
+_rendered_configs = (0, {})
+
+def render_client_config(server):
+    """Config for clients reaching hbbs at server, as (config, encoded), or None without a key.
+
+    config is what the client tasks used to build with regex_replace("serverip", ...)
+    and encoded is the string RustDesk's network settings accept.
+    """
+    global _rendered_configs
+    version, raw, _ = server_config
+    if raw is None:
+        return None
+    cached_version, cache = _rendered_configs
+    if cached_version != version:
+        cache = {}
+        _rendered_configs = (version, cache)
+    rendered = cache.get(server)
+    if rendered is None:
+        if len(cache) >= RENDERED_CONFIG_MAX:
+            cache.clear()
+        rendered = cache[server] = (raw.replace('serverip', server), convert_rustdesk_config(raw, server))
+    return rendered
+
+def connection_link(client_id, password=None):
+    """rustdesk:// deep link that opens a session to client_id."""
+    link = f"rustdesk://connection/new/{quote(str(client_id), safe='')}"
+    if password:
+        link += "?" + urlencode({"password": password})
+    return link
+
+def _inotify_changes(paths):
+    """Yield whenever one of paths is written, replaced or removed. Raises OSError if inotify is unavailable."""
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    if not hasattr(libc, 'inotify_init1'):
+        raise OSError("inotify is not available")
+    fd = libc.inotify_init1(os.O_CLOEXEC)
+    if fd < 0:
+        raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+    
+    # Watch the directories, since the files are replaced rather than edited in place
+    IN_CLOSE_WRITE, IN_MOVED_TO, IN_CREATE, IN_DELETE = 0x8, 0x80, 0x100, 0x200
+    names_by_wd = {}
+    try:
+        for directory in {os.path.dirname(p) for p in paths}:
+            wd = libc.inotify_add_watch(fd, directory.encode(), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f"Cannot watch {directory}")
+            names_by_wd[wd] = {os.path.basename(p) for p in paths if os.path.dirname(p) == directory}
+    except OSError:
+        os.close(fd)
+        raise
+    
+    with open(fd, 'rb', buffering=0) as events:
+        while True:
+            buf = events.read(4096)
+            changed = False
+            offset = 0
+            while offset < len(buf):
+                wd, _, _, length = struct.unpack_from('iIII', buf, offset)
+                name = buf[offset + 16:offset + 16 + length].rstrip(b'\0').decode()
+                changed = changed or name in names_by_wd.get(wd, ())
+                offset += 16 + length
+            if changed:
+                yield
+
+def watch_server_config():
+    """Reload the server config whenever KEY_PATH or the hbbs key changes (runs forever)."""
+    paths = [os.path.abspath(KEY_PATH), os.path.abspath(HBBS_KEY_PATH)]
+    try:
+        for _ in _inotify_changes(paths):
+            try:
+                reload_server_config()
+            except Exception as e:
+                app.logger.error(f"Failed to reload RustDesk config: {str(e)}")
+    except OSError as e:
+        app.logger.info(f"inotify unavailable ({str(e)}), polling key files every {CONFIG_POLL_INTERVAL}s")
+    
+    def mtimes():
+        return tuple(os.stat(p).st_mtime_ns if os.path.exists(p) else None for p in paths)
+    seen = mtimes()
+    while True:
+        time.sleep(CONFIG_POLL_INTERVAL)
+        current = mtimes()
+        if current != seen:
+            seen = current
+            try:
+                reload_server_config()
+            except Exception as e:
+                app.logger.error(f"Failed to reload RustDesk config: {str(e)}")
+
+def start_config_watcher():
+    threading.Thread(target=watch_server_config, name="config-watcher", daemon=True).start()
+
+reload_server_config()
+
+def _clients_file_stat():
+    st = os.stat(CLIENTS_FILE)
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+def client_snapshot():
+    """Current clients as ClientRecords, reparsing the file only when it has changed.
+
+    The records are shared between requests and must not be modified.
+    """
+    global _clients_cache
     try:
-        with open(CLIENTS_FILE, 'r') as f:
-            return json.load(f)
+        stat = _clients_file_stat()
+        if stat != _clients_cache[0]:
+            with open(CLIENTS_FILE, 'r') as f:
+                _clients_cache = (stat, tuple(ClientRecord.from_dict(c) for c in json.load(f)))
+        return _clients_cache[1]
     except Exception as e:
         app.logger.error(f"Failed to load clients: {str(e)}")
-        return []
+        return ()
+
+def load_clients():
+    """Load clients as dicts that the caller may edit and pass to save_clients."""
+    return [record.to_dict() for record in client_snapshot()]
 
-def save_clients(clients):
-    """Save clients to the JSON file."""
+def save_clients(clients, action, source=None):
+    """Save clients to the JSON file and record what changed under the given action name.
+
+    source defaults to the address of the current request. It may also be a
+    dict of client_id -> source when one save carries writes from several callers.
+    """
+    global _clients_cache
+    # Write to a temp file and swap it in so readers never see a partial file
+    tmp_path = CLIENTS_FILE + '.tmp'
     try:
-        with open(CLIENTS_FILE, 'w') as f:
-            json.dump(clients, f, indent=2)
-        return True
+        before = client_snapshot()
+        records = tuple(ClientRecord.from_dict(c) for c in clients)
+        with open(tmp_path, 'w') as f:
+            json.dump([record.to_dict() for record in records], f, indent=2)
+        os.replace(tmp_path, CLIENTS_FILE)
+        _clients_cache = (_clients_file_stat(), records)
     except Exception as e:
         app.logger.error(f"Failed to save clients: {str(e)}")
         return False
+    record_changes(before, records, action, source)
+    return True
+
+def _audit_segments():
+    """Audit segment names, oldest first."""
+    try:
+        names = os.listdir(AUDIT_DIR)
+    except FileNotFoundError:
+        return []
+    return sorted({name.split('.')[0] for name in names
+                   if name.startswith('audit-') and name.endswith(('.log', '.log.gz'))})
+
+def _open_audit_segment(name):
+    """Open a segment for binary reading, whether it is still active or already compressed."""
+    path = os.path.join(AUDIT_DIR, name + '.log')
+    if os.path.exists(path):
+        return open(path, 'rb')
+    return gzip.open(path + '.gz', 'rb')
+
+def roll_audit_segment(name):
+    """Compress a full segment and drop the oldest compressed ones beyond AUDIT_MAX_SEGMENTS."""
+    path = os.path.join(AUDIT_DIR, name + '.log')
+    with open(path, 'rb') as src, gzip.open(path + '.gz.tmp', 'wb') as dst:
+        for chunk in iter(lambda: src.read(65536), b''):
+            dst.write(chunk)
+    os.replace(path + '.gz.tmp', path + '.gz')
+    os.remove(path)
+    
+    compressed = [s for s in _audit_segments() if os.path.exists(os.path.join(AUDIT_DIR, s + '.log.gz'))]
+    for old in compressed[:-AUDIT_MAX_SEGMENTS]:
+        os.remove(os.path.join(AUDIT_DIR, old + '.log.gz'))
+
+def append_audit(lines):
+    """Append NDJSON lines to the active audit segment, rolling it over when full."""
+    global audit_segment
+    os.makedirs(AUDIT_DIR, exist_ok=True)
+    if audit_segment is None:
+        active = [s for s in _audit_segments() if os.path.exists(os.path.join(AUDIT_DIR, s + '.log'))]
+        audit_segment = active[-1] if active else f"audit-{datetime.now():%Y%m%d-%H%M%S-%f}"
+    path = os.path.join(AUDIT_DIR, audit_segment + '.log')
+    with open(path, 'a') as f:
+        f.write(''.join(line + '\n' for line in lines))
+    if os.path.getsize(path) >= AUDIT_SEGMENT_BYTES:
+        roll_audit_segment(audit_segment)
+        audit_segment = None
+
+def history_entry(client_id, change):
+    """JSON form of one (epoch, action, source, before, after) change."""
+    ts, action, source, before, after = change
+    return {
+        "time": _from_epoch(int(ts)),
+        "action": action,
+        "client_id": client_id,
+        "source": source,
+        "before": before.to_dict() if before is not None else None,
+        "after": after.to_dict() if after is not None else None
+    }
+
+def record_changes(before, after, action, source=None):
+    """Add every client that differs between two snapshots to its history ring and the audit log."""
+    old_by_id = {r.client_id: r for r in before}
+    new_ids = set()
+    changes = []
+    for record in after:
+        new_ids.add(record.client_id)
+        old = old_by_id.get(record.client_id)
+        if old is None or old != record:
+            changes.append((record.client_id, old, record))
+    changes.extend((client_id, old, None) for client_id, old in old_by_id.items() if client_id not in new_ids)
+    if not changes:
+        return
+    
+    if source is None and has_request_context():
+        source = request.remote_addr
+    sources = source if isinstance(source, dict) else None
+    now = time.time()
+    with audit_lock:
+        lines = []
+        for client_id, old, new in changes:
+            ring = client_history.get(client_id)
+            if ring is None:
+                ring = client_history[client_id] = deque(maxlen=HISTORY_PER_CLIENT)
+                if len(client_history) > HISTORY_MAX_CLIENTS:
+                    client_history.popitem(last=False)
+            else:
+                client_history.move_to_end(client_id)
+            change = (now, action, sources.get(client_id) if sources is not None else source, old, new)
+            ring.append(change)
+            lines.append(json.dumps(history_entry(client_id, change)))
+        try:
+            append_audit(lines)
+        except Exception as e:
+            app.logger.error(f"Failed to write audit log: {str(e)}")
+
+def upsert_client(clients, index, data, now=None):
+    """Merge data into the client with the same ID, or append it as a new client.
+
+    index maps client_id to its position in clients and is kept up to date.
+    Returns True if a new client was added.
+    """
+    now = now or datetime.now().isoformat()
+    i = index.get(data["client_id"])
+    if i is not None:
+        clients[i] = {**clients[i], **data, "last_seen": data.get("last_seen", now)}
+        return False
+    index[data["client_id"]] = len(clients)
+    clients.append({
+        **data,
+        "registered_at": data.get("registered_at", now),
+        "last_seen": data.get("last_seen", now)
+    })
+    return True
+
+def build_client_filter(params):
+    """Build a predicate from filter params (ip_prefix, os, manually_added, older_than in days).
+
+    Raises ValueError if a value is invalid or no criteria are given, so a bulk
+    action can never silently match the whole registry.
+    """
+    checks = []
+    ip_prefix = (params.get('ip_prefix') or '').strip()
+    if ip_prefix:
+        checks.append(lambda c: (c.get('ip_address') or '').startswith(ip_prefix))
+    os_name = (params.get('os') or '').strip().lower()
+    if os_name:
+        checks.append(lambda c: os_name in (c.get('os') or '').lower())
+    manual = str(params.get('manually_added') or '').strip().lower()
+    if manual:
+        if manual not in ('true', 'false'):
+            raise ValueError("manually_added must be true or false")
+        wanted = manual == 'true'
+        checks.append(lambda c: bool(c.get('manually_added')) == wanted)
+    older_than = str(params.get('older_than') or '').strip()
+    if older_than:
+        try:
+            days = float(older_than)
+        except ValueError:
+            raise ValueError("older_than must be a number of days")
+        # Timestamps are naive isoformat strings, which sort chronologically
+        cutoff = (datetime.now() - timedelta(days=days)).isoformat()
+        checks.append(lambda c: (c.get('last_seen') or '') < cutoff)
+    if not checks:
+        raise ValueError("At least one filter is required")
+    return lambda c: all(check(c) for check in checks)
+
+def bulk_update(clients, action, matches, value=''):
+    """Apply action to every matching client in the list, in place; returns the affected client IDs."""
+    affected = [c["client_id"] for c in clients if matches(c)]
+    if not affected:
+        return affected
+    if action == 'delete':
+        clients[:] = [c for c in clients if not matches(c)]
+    else:
+        for client in clients:
+            if not matches(client):
+                continue
+            if action == 'tag':
+                # /register stores whatever "tags" it is sent, so it may not be a list yet
+                tags = client.get('tags')
+                if isinstance(tags, str):
+                    tags = [tags]
+                elif isinstance(tags, list):
+                    tags = [str(t) for t in tags]
+                else:
+                    tags = []
+                if value not in tags:
+                    client['tags'] = tags + [value]
+            else:
+                client['notes'] = value
+    return affected
+
+def apply_bulk_action(action, matches, value=''):
+    """Apply action to every matching client with one save.
+
+    Returns the list of affected client IDs, or None if saving failed.
+    """
+    with clients_lock:
+        clients = load_clients()
+        affected = bulk_update(clients, action, matches, value)
+        if not affected:
+            return affected
+        if not save_clients(clients, f"bulk-{action}"):
+            return None
+    return affected
+
+def load_federation_peers():
+    """Read the peer list; entries are base URLs or {"name": ..., "url": ...} objects."""
+    try:
+        with open(FEDERATION_PEERS_FILE, 'r') as f:
+            entries = json.load(f)
+    except FileNotFoundError:
+        return []
+    except Exception as e:
+        app.logger.error(f"Failed to load federation peers: {str(e)}")
+        return []
+    
+    peers = []
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {"url": entry}
+        url = (entry.get("url") or '').rstrip('/')
+        if url:
+            peers.append({"name": entry.get("name") or urlparse(url).hostname or url, "url": url})
+    return peers
+
+federation_peers = load_federation_peers()
+federation_state = {
+    peer["url"]: {"etag": None, "clients": [], "fetched_at": 0, "failures": 0,
+                  "retry_at": 0, "error": None, "pending": None}
+    for peer in federation_peers
+}
+federation_lock = threading.Lock()
+federation_pool = ThreadPoolExecutor(max_workers=max(1, min(16, len(federation_peers))))
+
+def fetch_peer(peer):
+    """Revalidate one peer's registry via its /api/export feed and update its cache entry."""
+    state = federation_state[peer["url"]]
+    req = urllib.request.Request(peer["url"] + "/api/export")
+    if state["etag"]:
+        req.add_header("If-None-Match", state["etag"])
+    
+    clients, etag, error = None, None, None
+    try:
+        with urllib.request.urlopen(req, timeout=FEDERATION_TIMEOUT) as resp:
+            clients = [json.loads(line) for line in resp if line.strip()]
+            etag = resp.headers.get("ETag")
+    except urllib.error.HTTPError as e:
+        if e.code != 304:
+            error = f"HTTP {e.code}"
+    except Exception as e:
+        error = str(e)
+    
+    with federation_lock:
+        state["pending"] = None
+        if error:
+            state["failures"] += 1
+            state["retry_at"] = time.time() + min(2 ** state["failures"], FEDERATION_BACKOFF_MAX)
+            state["error"] = error
+            app.logger.warning(f"Federation peer {peer['name']} failed: {error}")
+            return
+        if clients is not None:
+            state["clients"] = clients
+            state["etag"] = etag
+        state["fetched_at"] = time.time()
+        state["failures"] = 0
+        state["error"] = None
+
+def refresh_federation():
+    """Start fetches for peers whose cache expired.
+
+    Only peers that have never been fetched are waited on, for up to
+    FEDERATION_DEADLINE; the rest are served stale while they revalidate.
+    Fetches still running keep going in the background and update the cache
+    when they finish.
+    """
+    now = time.time()
+    futures = []
+    with federation_lock:
+        for peer in federation_peers:
+            state = federation_state[peer["url"]]
+            if state["pending"] is None:
+                if now - state["fetched_at"] < FEDERATION_TTL or now < state["retry_at"]:
+                    continue
+                state["pending"] = federation_pool.submit(fetch_peer, peer)
+            if not state["fetched_at"]:
+                futures.append(state["pending"])
+    if futures:
+        wait(futures, timeout=FEDERATION_DEADLINE)
+
+def federated_clients():
+    """Merge local and cached peer registries, each client tagged with its range."""
+    refresh_federation()
+    merged = [{**c, "range": FEDERATION_LOCAL_NAME} for c in load_clients()]
+    peers = []
+    now = time.time()
+    with federation_lock:
+        for peer in federation_peers:
+            state = federation_state[peer["url"]]
+            merged.extend({**c, "range": peer["name"]} for c in state["clients"])
+            peers.append({
+                "name": peer["name"],
+                "url": peer["url"],
+                "clients": len(state["clients"]),
+                "error": state["error"],
+                "age": round(now - state["fetched_at"]) if state["fetched_at"] else None
+            })
+    return merged, peers
+
+# Counters and gauges exposed on /metrics
+metrics = Counter(dict.fromkeys([
+    "admission_admitted_total", "admission_rate_limited_total", "admission_overloaded_total",
+    "admission_too_large_total", "admission_inflight_writes"], 0))
+metrics_lock = threading.Lock()
+
+def count_metric(name, delta=1):
+    with metrics_lock:
+        metrics[name] += delta
+
+# Token buckets per source IP: ip -> [tokens, last refill (monotonic)]
+rate_buckets = {}
+rate_lock = threading.Lock()
+inflight_writes = threading.BoundedSemaphore(MAX_INFLIGHT_WRITES)
+
+def take_rate_token(source):
+    """Spend one token from source's bucket. Returns 0 if allowed, else seconds until a token is available."""
+    now = time.monotonic()
+    with rate_lock:
+        bucket = rate_buckets.get(source)
+        if bucket is None:
+            if len(rate_buckets) >= RATE_LIMIT_MAX_SOURCES:
+                # Buckets that have refilled completely carry no state worth keeping
+                for ip, (tokens, last) in list(rate_buckets.items()):
+                    if tokens + (now - last) * RATE_LIMIT_PER_SECOND >= RATE_LIMIT_BURST:
+                        del rate_buckets[ip]
+            bucket = rate_buckets[source] = [RATE_LIMIT_BURST, now]
+        tokens = min(RATE_LIMIT_BURST, bucket[0] + (now - bucket[1]) * RATE_LIMIT_PER_SECOND)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            return math.ceil((1 - tokens) / RATE_LIMIT_PER_SECOND)
+        bucket[0] = tokens - 1
+        return 0
+
+def admission_controlled(max_bytes):
+    """Reject oversized bodies (413), rate limit per source IP (429) and cap in-flight writes (503)."""
+    def decorator(view):
+        @functools.wraps(view)
+        def admitted_view(*args, **kwargs):
+            if request.content_length is not None and request.content_length > max_bytes:
+                count_metric("admission_too_large_total")
+                return jsonify({"status": "error", "message": f"Payload exceeds {max_bytes} bytes"}), 413
+            
+            retry_after = take_rate_token(request.remote_addr)
+            if retry_after:
+                count_metric("admission_rate_limited_total")
+                return jsonify({"status": "error", "message": "Rate limit exceeded"}), 429, {"Retry-After": str(retry_after)}
+            
+            if not inflight_writes.acquire(blocking=False):
+                count_metric("admission_overloaded_total")
+                return jsonify({"status": "error", "message": "Server busy"}), 503, {"Retry-After": str(OVERLOAD_RETRY_AFTER)}
+            count_metric("admission_admitted_total")
+            count_metric("admission_inflight_writes")
+            try:
+                return view(*args, **kwargs)
+            finally:
+                count_metric("admission_inflight_writes", -1)
+                inflight_writes.release()
+        return admitted_view
+    return decorator
+
+def is_profile_token(token):
+    """Check a caller-supplied token against PROFILE_TOKEN."""
+    return bool(PROFILE_TOKEN) and bool(token) and hmac.compare_digest(token, PROFILE_TOKEN)
+
+def rotate_profiles():
+    """Remove the oldest profiles beyond PROFILE_MAX_FILES."""
+    entries = sorted((e for e in os.scandir(PROFILE_DIR) if e.is_file()), key=lambda e: e.stat().st_mtime)
+    for entry in entries[:-PROFILE_MAX_FILES]:
+        try:
+            os.remove(entry.path)
+        except OSError as e:
+            app.logger.error(f"Failed to remove old profile {entry.name}: {str(e)}")
+
+# cProfile allows one active profiler per process, so profiled requests take turns
+request_profiler_lock = threading.Lock()
+sampler_lock = threading.Lock()
+
+def finish_profile(profiler, name):
+    """Stop a request profiler, save its stats and let the next profiled request in."""
+    try:
+        profiler.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profiler.dump_stats(os.path.join(PROFILE_DIR, name))
+        rotate_profiles()
+    except Exception as e:
+        app.logger.error(f"Failed to save profile {name}: {str(e)}")
+    finally:
+        request_profiler_lock.release()
+
+class ProfiledResponse:
+    """Passes a response body through unbuffered and finishes the profile when the server closes it."""
+    __slots__ = ("result", "profiler", "name")
+    
+    def __init__(self, result, profiler, name):
+        self.result = result
+        self.profiler = profiler
+        self.name = name
+    
+    def __iter__(self):
+        return iter(self.result)
+    
+    def close(self):
+        try:
+            if hasattr(self.result, 'close'):
+                self.result.close()
+        finally:
+            finish_profile(self.profiler, self.name)
+
+def profiling_middleware(wsgi_app):
+    """Run requests carrying the profile token under cProfile and save the stats.
+
+    The token is accepted as an X-Profile-Token header or a profile= query
+    parameter. The profiler keeps running while the server streams the body
+    and stops when the response is closed. Event streams never end on their
+    own, so for those only the handler itself is profiled.
+    """
+    def profiled_app(environ, start_response):
+        if environ.get('PATH_INFO', '').startswith('/api/profiles'):
+            return wsgi_app(environ, start_response)
+        token = environ.get('HTTP_X_PROFILE_TOKEN') or parse_qs(environ.get('QUERY_STRING', '')).get('profile', [''])[0]
+        if not is_profile_token(token) or not request_profiler_lock.acquire(blocking=False):
+            return wsgi_app(environ, start_response)
+        
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', environ.get('PATH_INFO', '')).strip('_') or 'root'
+        name = f"req-{datetime.now():%Y%m%d-%H%M%S}-{environ.get('REQUEST_METHOD', 'GET')}-{slug}-{uuid.uuid4().hex[:8]}.prof"
+        
+        event_stream = []
+        
+        def start_profiled_response(status, headers, exc_info=None):
+            event_stream[:] = [any(key.lower() == 'content-type' and value.startswith('text/event-stream')
+                                   for key, value in headers)]
+            return start_response(status, headers + [("X-Profile-File", name)], exc_info)
+        
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            result = wsgi_app(environ, start_profiled_response)
+        except BaseException:
+            finish_profile(profiler, name)
+            raise
+        if event_stream and event_stream[0]:
+            finish_profile(profiler, name)
+            return result
+        return ProfiledResponse(result, profiler, name)
+    return profiled_app
+
+if PROFILE_TOKEN:
+    app.wsgi_app = profiling_middleware(app.wsgi_app)
+
+def run_sampler(seconds):
+    """Sample every thread's stack for a while and write collapsed stacks (flamegraph input)."""
+    try:
+        counts = Counter()
+        me = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                counts[';'.join(reversed(stack))] += 1
+            time.sleep(PROFILE_SAMPLE_INTERVAL)
+        
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        with open(os.path.join(PROFILE_DIR, f"sample-{datetime.now():%Y%m%d-%H%M%S}.txt"), 'w') as f:
+            for stack, count in counts.most_common():
+                f.write(f"{stack} {count}\n")
+        rotate_profiles()
+    except Exception as e:
+        app.logger.error(f"Sampling profiler failed: {str(e)}")
+    finally:
+        sampler_lock.release()
+
+def registration_error(data):
+    """Why a /register payload is unacceptable, or None if it is fine."""
+    if not data:
+        return "No data provided"
+    if not isinstance(data, dict):
+        return "Payload must be a JSON object"
+    for field in ("client_id", "hostname"):
+        if field not in data:
+            return f"Missing required field: {field}"
+    # Numeric RustDesk IDs may arrive as JSON numbers; anything else can't key the registry
+    client_id = data["client_id"]
+    if isinstance(client_id, bool) or not isinstance(client_id, (str, int)) or client_id == '':
+        return "client_id must be a non-empty string"
+    return None
+
+def apply_registration(clients, index, data, ip_address, now):
+    """Apply one /register payload to clients. Returns True if the client is new."""
+    # Build the deep link here rather than trusting each client to format it
+    data = dict(data)
+    password = data.pop("password", None)
+    if password is not None:
+        data["connection_string"] = connection_link(data["client_id"], password)
+    
+    created = upsert_client(clients, index, {**data, "ip_address": ip_address, "last_seen": now}, now)
+    client = clients[index[data["client_id"]]]
+    if not client.get("connection_string"):
+        client["connection_string"] = connection_link(data["client_id"])
+    return created
+
+def manual_client(form, now):
+    """Client fields from the /add form."""
+    client_id = form.get('client_id')
+    return {
+        "client_id": client_id,
+        "hostname": form.get('hostname'),
+        "ip_address": form.get('ip_address'),
+        "os": form.get('os', ''),
+        "notes": form.get('notes', ''),
+        "connection_string": form.get('connection_string') or connection_link(client_id),
+        "last_seen": now,
+        "manually_added": True
+    }
+
+def apply_notes(clients, client_id, notes, now):
+    """Set a client's notes. Returns False if there is no such client."""
+    for client in clients:
+        if client["client_id"] == client_id:
+            client["notes"] = notes
+            client["last_seen"] = now
+            return True
+    return False
 
 @app.route('/rustdesk_config.txt', methods=['GET'])
 def get_key():
     """Serve the RustDesk public key."""
+    raw = server_config[1]
+    if raw is None:
+        app.logger.error("RustDesk key file not found")
+        abort(404)
+    return Response(raw, mimetype='application/octet-stream')
+
+def requested_server():
+    """Server address from ?server=, defaulting to the host the caller used to reach us."""
+    server = request.args.get('server') or urlparse('//' + request.host).hostname or ''
+    if not re.fullmatch(r'[A-Za-z0-9.:\-]{1,253}', server):
+        abort(400)
+    return server
+
+@app.route('/config', methods=['GET'])
+def client_config():
+    """Ready-to-apply config for `rustdesk --config`; ?format=encoded for the network settings string."""
+    rendered = render_client_config(requested_server())
+    if rendered is None:
+        app.logger.error("RustDesk key file not found")
+        abort(404)
+    return Response(rendered[1] if request.args.get('format') == 'encoded' else rendered[0], mimetype='text/plain')
+
+@app.route('/config/<client_id>', methods=['GET'])
+def client_config_bundle(client_id):
+    """Config strings and the connection deep link for one registered client."""
+    record = next((r for r in client_snapshot() if r.client_id == client_id), None)
+    if record is None:
+        return jsonify({"status": "error", "message": "Client not found"}), 404
+    server = requested_server()
+    rendered = render_client_config(server)
+    if rendered is None:
+        return jsonify({"status": "error", "message": "RustDesk key file not found"}), 404
+    return jsonify({
+        "status": "success",
+        "client_id": client_id,
+        "server": server,
+        "config": rendered[0],
+        "encoded": rendered[1],
+        "connection_string": record.connection_string or connection_link(client_id)
+    }), 200
+
+@app.route('/events', methods=['GET'])
+def config_events():
+    """Server-sent events that push the new paste config to dashboards when the key changes."""
     try:
-        if not os.path.exists(KEY_PATH):
-            app.logger.error("RustDesk key file not found")
-            abort(404)
-        return send_file(KEY_PATH, mimetype='application/octet-stream')
-    except Exception as e:
-        app.logger.error(f"Error serving key file: {str(e)}")
-        abort(500)
+        version = int(request.args.get('version', server_config[0]))
+    except ValueError:
+        version = server_config[0]
+    
+    def stream(version):
+        while True:
+            with config_changed:
+                config_changed.wait_for(lambda: server_config[0] != version, timeout=EVENT_KEEPALIVE)
+                current = server_config
+            if current[0] == version:
+                yield ": keepalive\n\n"
+                continue
+            version = current[0]
+            yield f"event: config\ndata: {json.dumps({'version': version, 'pasteconfig': current[2] or ''})}\n\n"
+    
+    return Response(stream(version), mimetype='text/event-stream', headers={"Cache-Control": "no-cache"})
 
 @app.route('/update-notes', methods=['POST'])
 def update_notes():
@@ -106,125 +1007,263 @@ def update_notes():
     if not client_id:
         return redirect(url_for('client_list', error="Client ID is required"))
     
-    clients = load_clients()
-    updated = False
-    
-    for i, client in enumerate(clients):
-        if client["client_id"] == client_id:
-            clients[i]["notes"] = notes
-            clients[i]["last_seen"] = datetime.now().isoformat()
-            updated = True
-            break
-    
-    if not updated:
-        return redirect(url_for('client_list', error="Client not found"))
+    with clients_lock:
+        clients = load_clients()
+        updated = apply_notes(clients, client_id, notes, datetime.now().isoformat())
+        
+        if not updated:
+            return redirect(url_for('client_list', error="Client not found"))
+        
+        saved = save_clients(clients, "notes")
     
-    if save_clients(clients):
+    if saved:
         return redirect(url_for('client_list'))
     else:
         return redirect(url_for('client_list', error="Failed to save client data"))
 
 @app.route('/register', methods=['POST'])
+@admission_controlled(REGISTER_MAX_BYTES)
 def register_client():
     """Register a new RustDesk client."""
     data = request.json
-    if not data:
-        return jsonify({"status": "error", "message": "No data provided"}), 400
-    
-    required_fields = ["client_id", "hostname"]
-    for field in required_fields:
-        if field not in data:
-            return jsonify({"status": "error", "message": f"Missing required field: {field}"}), 400
+    error = registration_error(data)
+    if error:
+        return jsonify({"status": "error", "message": error}), 400
     
     # Get the IP address from the request
     ip_address = request.remote_addr
+    now = datetime.now().isoformat()
     
-    # Load existing clients
-    clients = load_clients()
-    
-    # Check if client already exists
-    for i, client in enumerate(clients):
-        if client["client_id"] == data["client_id"]:
-            # Update existing client
-            clients[i] = {**client, **data, "ip_address": ip_address, "last_seen": datetime.now().isoformat()}
-            
-            if save_clients(clients):
-                return jsonify({"status": "success", "message": "Client updated"}), 200
-            else:
-                return jsonify({"status": "error", "message": "Failed to save client data"}), 500
-    
-    # Add new client
-    new_client = {
-        **data,
-        "ip_address": ip_address,
-        "registered_at": datetime.now().isoformat(),
-        "last_seen": datetime.now().isoformat()
-    }
-    clients.append(new_client)
+    with clients_lock:
+        clients = load_clients()
+        index = {c["client_id"]: i for i, c in enumerate(clients)}
+        created = apply_registration(clients, index, data, ip_address, now)
+        saved = save_clients(clients, "register")
     
-    if save_clients(clients):
+    if not saved:
+        return jsonify({"status": "error", "message": "Failed to save client data"}), 500
+    if created:
         return jsonify({"status": "success", "message": "Client registered"}), 201
+    return jsonify({"status": "success", "message": "Client updated"}), 200
+
+def export_records(fmt):
+    """Yield the registry as NDJSON lines or CSV rows, one client at a time."""
+    if fmt == 'csv':
+        out = io.StringIO()
+        writer = csv.DictWriter(out, fieldnames=EXPORT_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        for record in client_snapshot():
+            row = record.to_dict()
+            if isinstance(row.get('tags'), list):
+                row['tags'] = ';'.join(str(t) for t in row['tags'])
+            writer.writerow(row)
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+        yield out.getvalue()
     else:
-        return jsonify({"status": "error", "message": "Failed to save client data"}), 500
+        for record in client_snapshot():
+            yield json.dumps(record.to_dict()) + '\n'
+
+def gzip_stream(chunks):
+    """Gzip a stream of text chunks incrementally."""
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+def read_import_records(text, fmt):
+    """Yield client dicts from an NDJSON or CSV upload; None for unparseable lines."""
+    if fmt == 'csv':
+        for row in csv.DictReader(text):
+            record = {k: v for k, v in row.items() if k and v not in (None, '')}
+            if 'manually_added' in record:
+                record['manually_added'] = record['manually_added'].lower() == 'true'
+            if 'tags' in record:
+                record['tags'] = [t for t in record['tags'].split(';') if t]
+            yield record
+    else:
+        for line in text:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield None
+
+def commit_import_chunk(chunk):
+    """Upsert a chunk of records with one save. Returns the number created, or None on failure."""
+    with clients_lock:
+        clients = load_clients()
+        index = {c["client_id"]: i for i, c in enumerate(clients)}
+        created = sum(upsert_client(clients, index, record) for record in chunk)
+        if not save_clients(clients, "import"):
+            return None
+    return created
+
+@app.route('/api/export', methods=['GET'])
+def export_clients():
+    """Stream the registry as NDJSON (default) or CSV, optionally gzipped."""
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"status": "error", "message": f"Unsupported format: {fmt}"}), 400
+    
+    compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+    # The file is only ever replaced whole, so its stat identifies the content
+    try:
+        etag = '%x-%x-%x-%s%s' % (*_clients_file_stat(), fmt, '-gz' if compress else '')
+    except OSError:
+        etag = None
+    if etag and request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag, weak=True)
+        return response
+    
+    body = export_records(fmt)
+    mimetype = EXPORT_FORMATS[fmt]
+    filename = f"clients.{fmt}"
+    if compress:
+        body = gzip_stream(body)
+        mimetype = 'application/gzip'
+        filename += '.gz'
+    
+    response = Response(body, mimetype=mimetype,
+                        headers={"Content-Disposition": f"attachment; filename={filename}"})
+    if etag:
+        response.set_etag(etag, weak=True)
+    return response
+
+@app.route('/api/import', methods=['POST'])
+@admission_controlled(IMPORT_MAX_BYTES)
+def import_clients():
+    """Upsert clients from a streamed NDJSON or CSV upload, saving once per chunk."""
+    fmt = request.args.get('format') or ('csv' if request.mimetype == 'text/csv' else 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"status": "error", "message": f"Unsupported format: {fmt}"}), 400
+    
+    stream = request.stream
+    if request.content_encoding == 'gzip' or request.args.get('gzip', '').lower() in ('1', 'true', 'yes'):
+        stream = gzip.GzipFile(fileobj=stream)
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    
+    counts = {"created": 0, "updated": 0, "skipped": 0}
+    chunk = []
+    
+    def commit():
+        created = commit_import_chunk(chunk)
+        if created is None:
+            return False
+        counts["created"] += created
+        counts["updated"] += len(chunk) - created
+        chunk.clear()
+        return True
+    
+    try:
+        for record in read_import_records(text, fmt):
+            if not isinstance(record, dict) or not all(record.get(f) for f in ("client_id", "hostname")):
+                counts["skipped"] += 1
+                continue
+            chunk.append(record)
+            if len(chunk) >= IMPORT_CHUNK_SIZE and not commit():
+                return jsonify({"status": "error", "message": "Failed to save client data", **counts}), 500
+    except (OSError, EOFError, UnicodeDecodeError, csv.Error) as e:
+        app.logger.error(f"Import aborted: {str(e)}")
+        return jsonify({"status": "error", "message": f"Malformed upload: {str(e)}", **counts}), 400
+    
+    if chunk and not commit():
+        return jsonify({"status": "error", "message": "Failed to save client data", **counts}), 500
+    
+    return jsonify({"status": "success", "message": "Import complete", **counts}), 200
 
 @app.route('/', methods=['GET'])
 def client_list():
     """Display the list of registered clients."""
-    pasteconfig = convert_rustdesk_config(KEY_PATH)
-    clients = load_clients()
-    return render_template('clients.html', clients=clients, pasteconfig=pasteconfig)
+    version, _, pasteconfig = server_config
+    return render_template('clients.html', clients=client_snapshot(), pasteconfig=pasteconfig or '',
+                           config_version=version,
+                           error=request.args.get('error'), message=request.args.get('message'),
+                           federation_enabled=bool(federation_peers))
+
+@app.route('/federation', methods=['GET'])
+def federation_list():
+    """Read-only view of this range's clients merged with every federation peer's."""
+    version, _, pasteconfig = server_config
+    clients, peers = federated_clients()
+    return render_template('clients.html', clients=clients, pasteconfig=pasteconfig or '',
+                           config_version=version, federated=True, peers=peers)
+
+@app.route('/api/federation', methods=['GET'])
+def federation_api():
+    """Merged registry of this range and its federation peers as JSON."""
+    clients, peers = federated_clients()
+    return jsonify({"status": "success", "clients": clients, "peers": peers}), 200
+
+@app.route('/api/bulk', methods=['POST'])
+def bulk_api():
+    """Delete, tag or set notes on every client matching a filter."""
+    data = request.json
+    if not data:
+        return jsonify({"status": "error", "message": "No data provided"}), 400
+    
+    action = data.get('action')
+    value = data.get('value', '')
+    if action not in BULK_ACTIONS:
+        return jsonify({"status": "error", "message": f"Unsupported action: {action}"}), 400
+    if action == 'tag' and not value:
+        return jsonify({"status": "error", "message": "A tag value is required"}), 400
+    
+    try:
+        matches = build_client_filter(data.get('filter') or {})
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    
+    if data.get('dry_run'):
+        affected = [c["client_id"] for c in load_clients() if matches(c)]
+        return jsonify({"status": "success", "message": "Dry run", "matched": affected}), 200
+    
+    affected = apply_bulk_action(action, matches, value)
+    if affected is None:
+        return jsonify({"status": "error", "message": "Failed to save client data"}), 500
+    return jsonify({"status": "success", "message": f"{action} applied", "matched": affected}), 200
+
+@app.route('/bulk', methods=['POST'])
+def bulk_form():
+    """Dashboard form for bulk actions."""
+    action = request.form.get('action')
+    value = request.form.get('value', '').strip()
+    if action not in BULK_ACTIONS:
+        return redirect(url_for('client_list', error="Unsupported bulk action"))
+    if action == 'tag' and not value:
+        return redirect(url_for('client_list', error="A tag value is required"))
+    
+    try:
+        matches = build_client_filter(request.form)
+    except ValueError as e:
+        return redirect(url_for('client_list', error=str(e)))
+    
+    affected = apply_bulk_action(action, matches, value)
+    if affected is None:
+        return redirect(url_for('client_list', error="Failed to save client data"))
+    return redirect(url_for('client_list', message=f"{action} applied to {len(affected)} client(s)"))
 
 @app.route('/add', methods=['GET', 'POST'])
 def add_client():
     """Add a client manually through a form."""
     if request.method == 'POST':
-        client_id = request.form.get('client_id')
-        hostname = request.form.get('hostname')
-        ip_address = request.form.get('ip_address')
-        connection_string = request.form.get('connection_string')
-        os = request.form.get('os', '')
-        notes = request.form.get('notes', '')
-        
-        if not client_id or not hostname:
+        if not request.form.get('client_id') or not request.form.get('hostname'):
             return render_template('add_client.html', error="Client ID and Hostname are required fields")
         
-        clients = load_clients()
-        
-        # Check if client already exists
-        for i, client in enumerate(clients):
-            if client["client_id"] == client_id:
-                # Update existing client
-                clients[i] = {
-                    **client,
-                    "hostname": hostname,
-                    "ip_address": ip_address,
-                    "os": os,
-                    "notes": notes,
-                    "connection_string": connection_string,
-                    "last_seen": datetime.now().isoformat(),
-                    "manually_added": True
-                }
-                
-                if save_clients(clients):
-                    return redirect(url_for('client_list'))
-                else:
-                    return render_template('add_client.html', error="Failed to save client data")
-        
-        # Add new client
-        new_client = {
-            "client_id": client_id,
-            "hostname": hostname,
-            "ip_address": ip_address,
-            "os": os,
-            "notes": notes,
-            "connection_string": connection_string,
-            "registered_at": datetime.now().isoformat(),
-            "last_seen": datetime.now().isoformat(),
-            "manually_added": True
-        }
-        clients.append(new_client)
+        now = datetime.now().isoformat()
+        with clients_lock:
+            clients = load_clients()
+            index = {c["client_id"]: i for i, c in enumerate(clients)}
+            upsert_client(clients, index, manual_client(request.form, now), now)
+            saved = save_clients(clients, "add")
         
-        if save_clients(clients):
+        if saved:
             return redirect(url_for('client_list'))
         else:
             return render_template('add_client.html', error="Failed to save client data")
@@ -234,683 +1273,158 @@ def add_client():
 @app.route('/delete/<client_id>', methods=['POST'])
 def delete_client(client_id):
     """Delete a client from the registry."""
-    clients = load_clients()
-    clients = [c for c in clients if c["client_id"] != client_id]
+    with clients_lock:
+        clients = load_clients()
+        clients = [c for c in clients if c["client_id"] != client_id]
+        saved = save_clients(clients, "delete")
     
-    if save_clients(clients):
+    if saved:
         return redirect(url_for('client_list'))
     else:
         return redirect(url_for('client_list', error="Failed to delete client"))
 
-if __name__ == '__main__':
-    # Make sure the template directory exists
-    os.makedirs(TEMPLATE_DIR, exist_ok=True)
-    
-    # Create templates if they don't exist
-    template_path = os.path.join(TEMPLATE_DIR, 'clients.html')
-    if not os.path.exists(template_path):
-        with open(template_path, 'w') as f:
-            f.write("""<!DOCTYPE html>
-<html>
-<head>
-    <title>RustDesk Clients</title>
-    <meta name="viewport" content="width=device-width, initial-scale=1">
-    <link rel="stylesheet" href="https://fonts.googleapis.com/css2?family=Roboto:wght@300;400;500;700&display=swap">
-    <style>
-        body {
-            font-family: 'Roboto', sans-serif;
-            margin: 0;
-            padding: 20px;
-            background-color: #f0f2f5;
-            color: #333;
-        }
-        .header-container {
-            text-align: center;
-            margin-bottom: 40px;
-        }
-        h1 {
-            color: #2c3e50;
-            display: inline-block;
-            font-size: 2.5rem;
-            margin: 0;
-            padding: 10px 30px;
-            background: linear-gradient(135deg, #6a11cb 0%, #2575fc 100%);
-            color: white;
-            border-radius: 8px;
-            box-shadow: 0 4px 20px rgba(0,0,0,0.1);
-            letter-spacing: 1px;
-        }
-        .add-button-container {
-            text-align: center;
-            margin-bottom: 30px;
-        }
-        .add-button {
-            background-color: #27ae60;
-            color: white;
-            padding: 12px 24px;
-            text-decoration: none;
-            border-radius: 50px;
-            font-weight: 500;
-            box-shadow: 0 4px 6px rgba(39, 174, 96, 0.2);
-            transition: all 0.3s ease;
-            font-size: 1rem;
-            display: inline-block;
-        }
-        .add-button:hover {
-            background-color: #2ecc71;
-            transform: translateY(-2px);
-            box-shadow: 0 6px 8px rgba(39, 174, 96, 0.3);
-        }
-        .client-list {
-            display: flex;
-            flex-wrap: wrap;
-            gap: 25px;
-            justify-content: center;
-            max-width: 1400px;
-            margin: 0 auto;
-        }
-        .client-card {
-            position: relative;
-            width: 320px;
-            padding: 0;
-            transition: transform 0.3s ease, box-shadow 0.3s ease;
-        }
-        .client-card:hover {
-            transform: translateY(-5px);
-            box-shadow: 0 12px 20px rgba(0,0,0,0.15);
-        }
-        .monitor {
-            background-color: #2c3e50;
-            border-radius: 10px 10px 3px 3px;
-            padding: 12px;
-            box-shadow: 0 5px 15px rgba(0,0,0,0.2);
-            position: relative;
-        }
-        .monitor:before {
-            content: '';
-            position: absolute;
-            bottom: -15px;
-            left: 50%;
-            transform: translateX(-50%);
-            width: 60px;
-            height: 15px;
-            background-color: #34495e;
-            border-radius: 0 0 5px 5px;
-            z-index: -1;
-        }
-        .monitor:after {
-            content: '';
-            position: absolute;
-            bottom: -20px;
-            left: 50%;
-            transform: translateX(-50%);
-            width: 100px;
-            height: 5px;
-            background-color: #34495e;
-            border-radius: 5px;
-            z-index: -2;
-        }
-        .screen {
-            background-color: #ecf0f1;
-            border-radius: 5px;
-            padding: 15px;
-            position: relative;
-            min-height: 180px;
-        }
-        .client-id-display {
-            font-family: 'Courier New', monospace;
-            background-color: #2c3e50;
-            color: #2ecc71;
-            padding: 8px 12px;
-            border-radius: 5px;
-            font-size: 0.9rem;
-            margin: 10px 0;
-            text-align: center;
-            box-shadow: inset 0 0 10px rgba(0,0,0,0.3);
-            overflow: hidden;
-            text-overflow: ellipsis;
-            white-space: nowrap;
-        }
-        .power-button {
-            position: absolute;
-            right: 10px;
-            top: 10px;
-            width: 10px;
-            height: 10px;
-            background-color: #e74c3c;
-            border-radius: 50%;
-            border: 2px solid #c0392b;
-        }
-        .power-light {
-            position: absolute;
-            right: 30px;
-            top: 12px;
-            width: 6px;
-            height: 6px;
-            background-color: #2ecc71;
-            border-radius: 50%;
-            animation: blink 5s infinite;
-        }
-        @keyframes blink {
-            0%, 100% { opacity: 1; }
-            50% { opacity: 0.4; }
-        }
-        .client-header {
-            font-weight: 500;
-            font-size: 1.3rem;
-            margin-bottom: 10px;
-            color: #2c3e50;
-            overflow: hidden;
-            text-overflow: ellipsis;
-            white-space: nowrap;
-        }
-        .client-details {
-            margin-bottom: 15px;
-            font-size: 0.9rem;
-            color: #7f8c8d;
-        }
-        .action-buttons {
-            margin-top: 15px;
-            display: flex;
-            justify-content: space-between;
-            flex-wrap: wrap;
-            gap: 8px;
-        }
-        .connect-button {
-            display: inline-block;
-            background-color: #3498db;
-            color: white;
-            padding: 8px 12px;
-            text-decoration: none;
-            border-radius: 5px;
-            font-size: 0.85rem;
-            border: none;
-            flex: 1;
-            text-align: center;
-            transition: all 0.2s ease;
-            box-shadow: 0 2px 5px rgba(52, 152, 219, 0.3);
-            white-space: nowrap;
-        }
-        .connect-button:hover {
-            background-color: #2980b9;
-            box-shadow: 0 4px 8px rgba(52, 152, 219, 0.4);
-        }
-        .edit-button {
-            display: inline-block;
-            background-color: #f39c12;
-            color: white;
-            padding: 8px 12px;
-            text-decoration: none;
-            border-radius: 5px;
-            font-size: 0.85rem;
-            border: none;
-            flex: 1;
-            text-align: center;
-            transition: all 0.2s ease;
-            box-shadow: 0 2px 5px rgba(243, 156, 18, 0.3);
-            cursor: pointer;
-            white-space: nowrap;
-        }
-        .edit-button:hover {
-            background-color: #e67e22;
-            box-shadow: 0 4px 8px rgba(243, 156, 18, 0.4);
-        }
-        .delete-form {
-            display: inline;
-            flex: 1;
-        }
-        .delete-button {
-            background-color: #e74c3c;
-            color: white;
-            border: none;
-            padding: 8px 12px;
-            border-radius: 5px;
-            cursor: pointer;
-            font-size: 0.85rem;
-            width: 100%;
-            transition: all 0.2s ease;
-            box-shadow: 0 2px 5px rgba(231, 76, 60, 0.3);
-        }
-        .delete-button:hover {
-            background-color: #c0392b;
-            box-shadow: 0 4px 8px rgba(231, 76, 60, 0.4);
-        }
-        .timestamp {
-            font-size: 0.8rem;
-            color: #95a5a6;
-            margin-top: 10px;
-            text-align: center;
-        }
-        .manually-added {
-            position: absolute;
-            top: -10px;
-            right: -10px;
-            font-size: 0.7rem;
-            background-color: #f39c12;
-            color: white;
-            padding: 5px 10px;
-            border-radius: 20px;
-            z-index: 10;
-            box-shadow: 0 2px 5px rgba(0,0,0,0.2);
-        }
-        .notes {
-            font-style: italic;
-            color: #7f8c8d;
-            border-top: 1px solid #eee;
-            overflow: hidden;
-            text-overflow: ellipsis;
-        }
-        .no-clients {
-            text-align: center;
-            margin-top: 50px;
-            font-size: 1.2rem;
-            color: #7f8c8d;
-        }
-        .os-icon {
-            margin-right: 5px;
-            font-size: 0.9rem;
-        }
-        .monitor-ports {
-            position: absolute;
-            bottom: -10px;
-            left: 50%;
-            transform: translateX(-50%);
-            display: flex;
-            gap: 5px;
-        }
-        .port {
-            width: 8px;
-            height: 3px;
-            background-color: #7f8c8d;
-            border-radius: 1px;
-        }
-        /* Modal styles */
-        .modal {
-            display: none;
-            position: fixed;
-            top: 0;
-            left: 0;
-            width: 100%;
-            height: 100%;
-            background-color: rgba(0,0,0,0.5);
-            z-index: 100;
-            align-items: center;
-            justify-content: center;
-        }
-        .modal-content {
-            background-color: white;
-            padding: 25px;
-            border-radius: 10px;
-            width: 90%;
-            max-width: 500px;
-            box-shadow: 0 5px 20px rgba(0,0,0,0.2);
-            position: relative;
-        }
-        .modal-title {
-            margin-top: 0;
-            color: #2c3e50;
-            border-bottom: 1px solid #eee;
-            padding-bottom: 15px;
-        }
-        .close-button {
-            position: absolute;
-            top: 15px;
-            right: 20px;
-            font-size: 1.5rem;
-            color: #95a5a6;
-            cursor: pointer;
-            transition: color 0.2s;
-        }
-        .close-button:hover {
-            color: #7f8c8d;
-        }
-        textarea.notes-input {
-            width: 100%;
-            padding: 12px;
-            border: 1px solid #ddd;
-            border-radius: 5px;
-            min-height: 120px;
-            margin: 15px 0;
-            font-family: 'Roboto', sans-serif;
-            font-size: 0.95rem;
-            resize: vertical;
-        }
-        .modal-buttons {
-            display: flex;
-            justify-content: flex-end;
-            gap: 10px;
-            margin-top: 20px;
-        }
-        .save-notes-button {
-            background-color: #27ae60;
-            color: white;
-            border: none;
-            padding: 10px 20px;
-            border-radius: 5px;
-            cursor: pointer;
-            font-weight: 500;
-        }
-        .save-notes-button:hover {
-            background-color: #2ecc71;
-        }
-        .cancel-notes-button {
-            background-color: #95a5a6;
-            color: white;
-            border: none;
-            padding: 10px 20px;
-            border-radius: 5px;
-            cursor: pointer;
-            font-weight: 500;
-        }
-        .cancel-notes-button:hover {
-            background-color: #7f8c8d;
-        }
-    </style>
-</head>
-<body>
-    <div class="header-container">
-        <h1>RustDesk Clients</h1>
-    </div>
-    <div class="add-button-container">
-        <a id="copyconfig" href="#" onclick="copyconfig();" class="add-button">Copy Server Config for Importing</a>
-    </div>
-    <div class="add-button-container">
-        <a href="/add" class="add-button">+ Add Client</a>
-    </div>
-
-    {% if clients %}
-    <div class="client-list">
-        {% for client in clients %}
-        <div class="client-card">
-            {% if client.manually_added %}
-            <span class="manually-added">Manually Added</span>
-            {% endif %}
-
-            <div class="monitor">
-                <div class="power-button"></div>
-                <div class="power-light"></div>
-
-                <div class="screen">
-                    <div class="client-header">{{ client.hostname }}</div>
-
-                    <div class="client-id-display">{{ client.client_id }}</div>
-
-                    <div class="client-details">
-                        <div><i class="os-icon">🖥️</i> {% if client.os %}{{ client.os }}{% else %}Unknown OS{% endif %}</div>
-                        <div><i class="os-icon">🌐</i> {{ client.ip_address }}</div>
-                    {% if client.notes %}
-                    <div class="notes"><i class="os-icon">📝</i> {{ client.notes }}</div>
-                    {% endif %}
-                    </div>
-
-                    <div class="action-buttons">
-                        <a href="{{ client.connection_string }}" class="connect-button">Connect</a>
-                        <button class="edit-button" onclick="openNotesModal('{{ client.client_id }}', '{{ client.notes|default('') }}')">Edit Notes</button>
-                        <form class="delete-form" action="/delete/{{ client.client_id }}" method="post" onsubmit="return confirm('Are you sure you want to remove this client?');">
-                            <button type="submit" class="delete-button">Delete</button>
-                        </form>
-                    </div>
-                </div>
-
-                <div class="monitor-ports">
-                    <div class="port"></div>
-                    <div class="port"></div>
-                    <div class="port"></div>
-                </div>
-            </div>
-            <br>
-            <div class="timestamp">
-                Added: {{ client.registered_at.split('T')[0] }}
-                <br>Last seen: {{ client.last_seen.split('T')[0] }}
-            </div>
-        </div>
-        {% endfor %}
-    </div>
-    {% else %}
-    <div class="no-clients">
-        <p>No clients registered yet. Click "Add Client" to add your first client.</p>
-    </div>
-    {% endif %}
-
-    <!-- Notes Modal -->
-    <div id="notesModal" class="modal">
-        <div class="modal-content">
-            <h3 class="modal-title">Edit Client Notes</h3>
-            <span class="close-button" onclick="closeNotesModal()">&times;</span>
-
-            <form id="notesForm" action="/update-notes" method="post">
-                <input type="hidden" id="clientIdInput" name="client_id">
-                <textarea class="notes-input" id="clientNotesInput" name="notes" placeholder="Enter notes about this client..."></textarea>
-
-                <div class="modal-buttons">
-                    <button type="button" class="cancel-notes-button" onclick="closeNotesModal()">Cancel</button>
-                    <button type="submit" class="save-notes-button">Save Notes</button>
-                </div>
-            </form>
-        </div>
-    </div>
-
-    <script>
-function copyconfig() {
-const textArea = document.createElement("textarea");
-        textArea.value = "{{ pasteconfig }}";
-            
-        // Move textarea out of the viewport so it's not visible
-        textArea.style.position = "absolute";
-        textArea.style.left = "-999999px";
-            
-        document.body.prepend(textArea);
-        textArea.select();
+@app.route('/api/history/<client_id>', methods=['GET'])
+def client_history_api(client_id):
+    """Recent changes to one client, newest first, from the in-memory ring."""
+    with audit_lock:
+        changes = list(client_history.get(client_id, ()))
+    return jsonify({"status": "success",
+                    "history": [history_entry(client_id, c) for c in reversed(changes)]}), 200
 
-        try {
-            document.execCommand('copy');
-        } catch (error) {
-            console.error(error);
-        } finally {
-            textArea.remove();
-        }
+@app.route('/api/audit', methods=['GET'])
+def audit_api():
+    """Page through the audit log oldest first, reading only as far as the page needs.
 
-}
-        // Modal functionality
-        var modal = document.getElementById("notesModal");
-        var clientIdInput = document.getElementById("clientIdInput");
-        var clientNotesInput = document.getElementById("clientNotesInput");
-
-        function openNotesModal(clientId, notes) {
-            clientIdInput.value = clientId;
-            clientNotesInput.value = notes;
-            modal.style.display = "flex";
-        }
-
-        function closeNotesModal() {
-            modal.style.display = "none";
-        }
-
-        // Close the modal if the user clicks outside of it
-        window.onclick = function(event) {
-            if (event.target == modal) {
-                closeNotesModal();
-            }
-        }
-    </script>
-</body>
-</html>""")
-    
-    add_template_path = os.path.join(TEMPLATE_DIR, 'add_client.html')
-    if not os.path.exists(add_template_path):
-        with open(add_template_path, 'w') as f:
-            f.write("""<!DOCTYPE html>
-<html>
-<head>
-    <title>Add RustDesk Client</title>
-    <meta name="viewport" content="width=device-width, initial-scale=1">
-    <link rel="stylesheet" href="https://fonts.googleapis.com/css2?family=Roboto:wght@300;400;500;700&display=swap">
-    <style>
-        body {
-            font-family: 'Roboto', sans-serif;
-            margin: 0;
-            padding: 20px;
-            background-color: #f0f2f5;
-            color: #333;
-            display: flex;
-            justify-content: center;
-            align-items: center;
-            min-height: 100vh;
-        }
-        .container {
-            max-width: 600px;
-            width: 100%;
-            background-color: white;
-            padding: 30px;
-            border-radius: 10px;
-            box-shadow: 0 10px 30px rgba(0,0,0,0.1);
-        }
-        h1 {
-            color: #2c3e50;
-            text-align: center;
-            margin-bottom: 30px;
-            font-size: 2rem;
-        }
-        .form-group {
-            margin-bottom: 25px;
-            position: relative;
-        }
-        label {
-            display: block;
-            margin-bottom: 8px;
-            font-weight: 500;
-            color: #2c3e50;
-        }
-        input[type="text"],
-        textarea {
-            width: 100%;
-            padding: 12px 15px;
-            border: 1px solid #ddd;
-            border-radius: 6px;
-            box-sizing: border-box;
-            font-family: 'Roboto', sans-serif;
-            font-size: 1rem;
-            transition: border-color 0.3s, box-shadow 0.3s;
-        }
-        input[type="text"]:focus,
-        textarea:focus {
-            border-color: #3498db;
-            outline: none;
-            box-shadow: 0 0 0 3px rgba(52, 152, 219, 0.2);
-        }
-        textarea {
-            height: 120px;
-            resize: vertical;
-        }
-        .button-group {
-            margin-top: 30px;
-            display: flex;
-            justify-content: center;
-            gap: 15px;
-        }
-        .submit-button {
-            background: linear-gradient(135deg, #3498db, #2980b9);
-            color: white;
-            border: none;
-            padding: 12px 25px;
-            border-radius: 50px;
-            cursor: pointer;
-            font-size: 1rem;
-            font-weight: 500;
-            transition: all 0.3s ease;
-            min-width: 140px;
-            box-shadow: 0 4px 6px rgba(52, 152, 219, 0.3);
-        }
-        .submit-button:hover {
-            transform: translateY(-2px);
-            box-shadow: 0 6px 8px rgba(52, 152, 219, 0.4);
-        }
-        .cancel-button {
-            background: linear-gradient(135deg, #95a5a6, #7f8c8d);
-            color: white;
-            border: none;
-            padding: 12px 25px;
-            border-radius: 50px;
-            cursor: pointer;
-            min-width: 140px;
-            text-decoration: none;
-            text-align: center;
-            font-size: 1rem;
-            font-weight: 500;
-            transition: all 0.3s ease;
-            box-shadow: 0 4px 6px rgba(127, 140, 141, 0.3);
-            display: inline-block;
-        }
-        .cancel-button:hover {
-            transform: translateY(-2px);
-            box-shadow: 0 6px 8px rgba(127, 140, 141, 0.4);
-        }
-        .error-message {
-            background-color: #fceaea;
-            border-left: 4px solid #e74c3c;
-            color: #c0392b;
-            padding: 12px 15px;
-            margin-bottom: 25px;
-            border-radius: 4px;
-        }
-        .required {
-            color: #e74c3c;
-            margin-left: 3px;
-        }
-        .monitor-icon {
-            text-align: center;
-            margin-bottom: 20px;
-            font-size: 60px;
-        }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <div class="monitor-icon">🖥️</div>
-        <h1>Add RustDesk Client</h1>
-
-        {% if error %}
-        <div class="error-message">{{ error }}</div>
-        {% endif %}
-
-        <form method="post">
-            <div class="form-group">
-                <label for="client_id">Client ID <span class="required">*</span></label>
-                <input type="text" id="client_id" name="client_id" required placeholder="Enter RustDesk client ID">
-            </div>
-
-            <div class="form-group">
-                <label for="hostname">Hostname <span class="required">*</span></label>
-                <input type="text" id="hostname" name="hostname" required placeholder="Computer name">
-            </div>
-
-            <div class="form-group">
-                <label for="ip_address">IP Address</label>
-                <input type="text" id="ip_address" name="ip_address" placeholder="Optional: 192.168.1.100">
-            </div>
-
-            <div class="form-group">
-                <label for="os">Operating System</label>
-                <input type="text" id="os" name="os" placeholder="Optional: Windows 11, Ubuntu 22.04, etc.">
-            </div>
-
-            <div class="form-group">
-                <label for="connection_string">Connection String</label>
-                <input type="text" id="connection_string" name="connection_string" placeholder="Optional: rustdesk://new/connection/clientid?password=password">
-</div>
-            <div class="form-group">
-                <label for="notes">Notes</label>
-                <textarea id="notes" name="notes" placeholder="Add any additional information about this client"></textarea>
-            </div>
-
-            <div class="button-group">
-                <button type="submit" class="submit-button">Add Client</button>
-                <a href="/" class="cancel-button">Cancel</a>
-            </div>
-        </form>
-    </div>
-</body>
-</html>""")
+    Pass the returned cursor back to continue; with more=false it can be
+    polled later for new entries.
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', 100)), 1), AUDIT_PAGE_MAX)
+    except ValueError:
+        return jsonify({"status": "error", "message": "limit must be a number"}), 400
+    client_id = request.args.get('client_id')
+    
+    segments = _audit_segments()
+    start, offset = (segments[0] if segments else None), 0
+    cursor = request.args.get('cursor')
+    if cursor:
+        name, _, position = cursor.rpartition(':')
+        try:
+            offset = int(position)
+        except ValueError:
+            return jsonify({"status": "error", "message": "Invalid cursor"}), 400
+        if name in segments:
+            start = name
+        else:
+            # The segment has been pruned; resume from the oldest one still kept
+            offset = 0
+    
+    entries = []
+    next_cursor = cursor
+    more = False
+    for name in segments[segments.index(start):] if start else []:
+        position = offset if name == start else 0
+        with _open_audit_segment(name) as f:
+            f.seek(position)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # Partially written; pick it up on the next call
+                position += len(line)
+                entry = json.loads(line)
+                if client_id and entry.get("client_id") != client_id:
+                    continue
+                entries.append(entry)
+                if len(entries) >= limit:
+                    more = True
+                    break
+        next_cursor = f"{name}:{position}"
+        if more:
+            break
+    
+    return jsonify({"status": "success", "entries": entries, "cursor": next_cursor, "more": more}), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Expose server counters in Prometheus text format."""
+    with metrics_lock:
+        values = dict(metrics)
+    with rate_lock:
+        values["admission_tracked_sources"] = len(rate_buckets)
+    values["admission_max_inflight_writes"] = MAX_INFLIGHT_WRITES
+    values["clients_registered"] = len(client_snapshot())
     
+    lines = []
+    for name, value in sorted(values.items()):
+        kind = "counter" if name.endswith("_total") else "gauge"
+        lines.append(f"# TYPE rustdesk_addressbook_{name} {kind}")
+        lines.append(f"rustdesk_addressbook_{name} {value}")
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+def require_profile_token():
+    """Hide the profile endpoints unless profiling is enabled and the caller has the token."""
+    token = request.headers.get('X-Profile-Token') or request.args.get('profile')
+    if not is_profile_token(token):
+        abort(404)
+
+@app.route('/api/profiles', methods=['GET'])
+def list_profiles():
+    """List saved profiles, newest first."""
+    require_profile_token()
+    try:
+        entries = sorted((e for e in os.scandir(PROFILE_DIR) if e.is_file()),
+                         key=lambda e: e.stat().st_mtime, reverse=True)
+    except FileNotFoundError:
+        entries = []
+    profiles = [{
+        "name": e.name,
+        "size": e.stat().st_size,
+        "created": datetime.fromtimestamp(e.stat().st_mtime).isoformat()
+    } for e in entries]
+    return jsonify({"status": "success", "profiles": profiles, "sampling": sampler_lock.locked()}), 200
+
+@app.route('/api/profiles/<name>', methods=['GET'])
+def download_profile(name):
+    """Download a saved profile."""
+    require_profile_token()
+    return send_from_directory(os.path.abspath(PROFILE_DIR), name, as_attachment=True)
+
+@app.route('/api/profiles/sampling', methods=['POST'])
+def start_sampling():
+    """Sample the whole process in the background for ?seconds= (default 30)."""
+    require_profile_token()
+    try:
+        seconds = float(request.args.get('seconds', 30))
+    except ValueError:
+        return jsonify({"status": "error", "message": "seconds must be a number"}), 400
+    if not 0 < seconds <= PROFILE_SAMPLE_MAX_SECONDS:
+        return jsonify({"status": "error", "message": f"seconds must be between 0 and {PROFILE_SAMPLE_MAX_SECONDS}"}), 400
+    if not sampler_lock.acquire(blocking=False):
+        return jsonify({"status": "error", "message": "Sampling already running"}), 409
+    threading.Thread(target=run_sampler, args=(seconds,), daemon=True).start()
+    return jsonify({"status": "success", "message": f"Sampling for {seconds:g}s"}), 202
+
+def warm_start():
+    """Compile every template and load the registry so the first request doesn't pay for it."""
+    for name in app.jinja_env.list_templates(extensions=["html"]):
+        app.jinja_env.get_template(name)
+    client_snapshot()
+
+def notify_systemd(state):
+    """Send a state line such as READY=1 to systemd when running as a Type=notify service."""
+    address = os.environ.get("NOTIFY_SOCKET")
+    if not address:
+        return
+    if address.startswith("@"):
+        address = "\0" + address[1:]
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+        sock.connect(address)
+        sock.sendall(state.encode())
+
+if __name__ == '__main__':
+    warm_start()
+    server = make_server('0.0.0.0', httpportchangeme, app, threaded=True)
     app.logger.info("Starting RustDesk Client Management Server")
-    app.run(host='0.0.0.0', port=httpportchangeme)
+    start_config_watcher()
+    notify_systemd("READY=1")
+    server.serve_forever()
+
@@ -0,0 +1,543 @@
+"""ASGI entry point for the RustDesk address book.
+
+Serves the dashboard, registration, config and export routes of
+RustdeskAddressbook.py on an event loop, so idle and long-polling connections cost a socket instead
+of a thread. Reads come from the shared in-memory client snapshot and every
+write goes through a single writer task. Requires uvicorn:
+
+    python3 RustdeskAddressbookAsgi.py
+"""
+import asyncio
+import itertools
+import json
+import re
+import socket
+from datetime import datetime
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from werkzeug.http import parse_etags, quote_etag
+
+import RustdeskAddressbook as addressbook
+
+WRITE_QUEUE_MAX = 1000  # Queued writes before new ones get 503
+WRITER_BATCH_MAX = 200  # Writes applied per batch; consecutive writes of the same kind share one save
+FORM_MAX_BYTES = 1024 * 1024  # Largest dashboard form body accepted
+EXPORT_CHUNK_BYTES = 64 * 1024  # Export body gathered per send
+
+write_queue = None
+config_event = None
+background_tasks = set()
+
+async def respond(send, status, body=b"", content_type="text/plain; charset=utf-8", headers=()):
+    """Send a complete response."""
+    if isinstance(body, str):
+        body = body.encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type.encode()), (b"content-length", str(len(body)).encode())]
+                   + [(name.encode(), value.encode()) for name, value in headers]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+async def respond_json(send, status, data, headers=()):
+    await respond(send, status, json.dumps(data), "application/json", headers)
+
+async def redirect_home(send, **params):
+    """Redirect to the dashboard, passing error/message the way the Flask routes do."""
+    await respond(send, 302, headers=[("location", "/?" + urlencode(params) if params else "/")])
+
+def client_address(scope):
+    return scope["client"][0] if scope.get("client") else None
+
+def query_params(scope):
+    return {k: v[0] for k, v in parse_qs(scope.get("query_string", b"").decode("latin-1")).items()}
+
+def header(scope, name):
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+def content_length(scope):
+    try:
+        return int(header(scope, b"content-length"))
+    except (TypeError, ValueError):
+        return None
+
+def requested_server(scope):
+    """Server address from ?server=, defaulting to the host the caller used to reach us; None if invalid."""
+    server = query_params(scope).get('server') or urlparse('//' + (header(scope, b"host") or '')).hostname or ''
+    return server if re.fullmatch(r'[A-Za-z0-9.:\-]{1,253}', server) else None
+
+async def read_body(receive, limit):
+    """Read the request body, or return None once it grows past limit."""
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        body += message.get("body", b"")
+        if len(body) > limit:
+            return None
+        if not message.get("more_body"):
+            return bytes(body)
+
+async def read_form(receive):
+    body = await read_body(receive, FORM_MAX_BYTES)
+    if body is None:
+        return None
+    return {k: v[0] for k, v in parse_qs(body.decode("utf-8", "replace"), keep_blank_values=True).items()}
+
+async def render(name, **context):
+    """Render a Flask template off the event loop."""
+    template = addressbook.app.jinja_env.get_template(name)
+    return await asyncio.to_thread(template.render, **context)
+
+def resolve_write(future, saved, result, error):
+    if future.done():
+        return  # The caller went away
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result((saved, result))
+
+def commit_batch(loop, batch):
+    """Apply (action, source, client_id, op, future) jobs, saving once per run of jobs with the same action.
+
+    Each change is audited with the source of the job that wrote that client.
+    A job whose op raises is dropped whole: the registry is reloaded and the
+    other jobs replayed without it, so none of its partial changes are saved.
+    """
+    for action, jobs in itertools.groupby(batch, key=lambda job: job[0]):
+        jobs = list(jobs)
+        failed = {}
+        with addressbook.clients_lock:
+            while True:
+                clients = addressbook.load_clients()
+                index = {c["client_id"]: i for i, c in enumerate(clients)}
+                sources = {}
+                results = []
+                for n, (_, source, client_id, op, future) in enumerate(jobs):
+                    if n in failed:
+                        continue
+                    try:
+                        result = op(clients, index)
+                    except Exception as e:
+                        failed[n] = e
+                        break
+                    results.append((future, result))
+                    sources.update(dict.fromkeys([client_id] if client_id is not None else result, source))
+                else:
+                    break
+            saved = addressbook.save_clients(clients, action, sources) if results else False
+        for future, result in results:
+            loop.call_soon_threadsafe(resolve_write, future, saved, result, None)
+        for n, error in failed.items():
+            loop.call_soon_threadsafe(resolve_write, jobs[n][4], False, None, error)
+
+async def writer():
+    """The only task that writes the clients file; applies queued writes in batches."""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await write_queue.get()]
+        while len(batch) < WRITER_BATCH_MAX and not write_queue.empty():
+            batch.append(write_queue.get_nowait())
+        try:
+            await asyncio.to_thread(commit_batch, loop, batch)
+        except Exception as e:
+            addressbook.app.logger.error(f"Writer failed: {str(e)}")
+            for _, _, _, _, future in batch:
+                resolve_write(future, False, None, None)
+
+async def submit_write(action, source, client_id, op):
+    """Queue op(clients, index), which writes client_id, for the writer and wait for it.
+
+    Pass client_id=None when op writes several clients and returns their IDs.
+
+    Returns (saved, op's result), or None if the queue is full. If op raised,
+    the error is logged and (False, None) returned.
+    """
+    future = asyncio.get_running_loop().create_future()
+    try:
+        write_queue.put_nowait((action, source, client_id, op, future))
+    except asyncio.QueueFull:
+        return None
+    try:
+        return await future
+    except Exception as e:
+        addressbook.app.logger.error(f"Failed to apply {action}: {str(e)}")
+        return False, None
+
+def signal_config_change():
+    """Wake every /events stream; runs on the event loop."""
+    global config_event
+    changed, config_event = config_event, asyncio.Event()
+    changed.set()
+
+async def client_list(scope, receive, send):
+    """Display the list of registered clients."""
+    params = query_params(scope)
+    version, _, pasteconfig = addressbook.server_config
+    html = await render('clients.html', clients=addressbook.client_snapshot(), pasteconfig=pasteconfig or '',
+                        config_version=version, error=params.get('error'), message=params.get('message'),
+                        federation_enabled=bool(addressbook.federation_peers))
+    await respond(send, 200, html, "text/html; charset=utf-8")
+
+async def get_key(scope, receive, send):
+    """Serve the RustDesk public key."""
+    raw = addressbook.server_config[1]
+    if raw is None:
+        addressbook.app.logger.error("RustDesk key file not found")
+        await respond(send, 404, "Not Found")
+        return
+    await respond(send, 200, raw, "application/octet-stream")
+
+async def client_config(scope, receive, send):
+    """Ready-to-apply config for `rustdesk --config`; ?format=encoded for the network settings string."""
+    server = requested_server(scope)
+    if server is None:
+        await respond(send, 400, "Bad Request")
+        return
+    rendered = addressbook.render_client_config(server)
+    if rendered is None:
+        addressbook.app.logger.error("RustDesk key file not found")
+        await respond(send, 404, "Not Found")
+        return
+    encoded = query_params(scope).get('format') == 'encoded'
+    await respond(send, 200, rendered[1] if encoded else rendered[0], "text/plain; charset=utf-8")
+
+async def client_config_bundle(scope, receive, send, client_id):
+    """Config strings and the connection deep link for one registered client."""
+    record = next((r for r in addressbook.client_snapshot() if r.client_id == client_id), None)
+    if record is None:
+        await respond_json(send, 404, {"status": "error", "message": "Client not found"})
+        return
+    server = requested_server(scope)
+    if server is None:
+        await respond(send, 400, "Bad Request")
+        return
+    rendered = addressbook.render_client_config(server)
+    if rendered is None:
+        await respond_json(send, 404, {"status": "error", "message": "RustDesk key file not found"})
+        return
+    await respond_json(send, 200, {
+        "status": "success",
+        "client_id": client_id,
+        "server": server,
+        "config": rendered[0],
+        "encoded": rendered[1],
+        "connection_string": record.connection_string or addressbook.connection_link(client_id)
+    })
+
+def next_export_chunk(body):
+    """Pull about EXPORT_CHUNK_BYTES from an export generator; b"" once it is exhausted."""
+    chunk = bytearray()
+    for part in body:
+        chunk += part.encode() if isinstance(part, str) else part
+        if len(chunk) >= EXPORT_CHUNK_BYTES:
+            break
+    return bytes(chunk)
+
+async def export_clients(scope, receive, send):
+    """Stream the registry as NDJSON (default) or CSV, optionally gzipped."""
+    params = query_params(scope)
+    fmt = params.get('format', 'ndjson')
+    if fmt not in addressbook.EXPORT_FORMATS:
+        await respond_json(send, 400, {"status": "error", "message": f"Unsupported format: {fmt}"})
+        return
+
+    compress = params.get('gzip', '').lower() in ('1', 'true', 'yes')
+    try:
+        etag = '%x-%x-%x-%s%s' % (*addressbook._clients_file_stat(), fmt, '-gz' if compress else '')
+    except OSError:
+        etag = None
+    headers = [("etag", quote_etag(etag, weak=True))] if etag else []
+    if etag and parse_etags(header(scope, b"if-none-match")).contains_weak(etag):
+        await respond(send, 304, headers=headers)
+        return
+
+    body = addressbook.export_records(fmt)
+    content_type = addressbook.EXPORT_FORMATS[fmt]
+    filename = f"clients.{fmt}"
+    if compress:
+        body = addressbook.gzip_stream(body)
+        content_type = 'application/gzip'
+        filename += '.gz'
+
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", content_type.encode()),
+                    (b"content-disposition", f"attachment; filename={filename}".encode())]
+                   + [(name.encode(), value.encode()) for name, value in headers]
+    })
+    while True:
+        chunk = await asyncio.to_thread(next_export_chunk, body)
+        await send({"type": "http.response.body", "body": chunk, "more_body": bool(chunk)})
+        if not chunk:
+            return
+
+async def federation_list(scope, receive, send):
+    """Read-only view of this range's clients merged with every federation peer's."""
+    version, _, pasteconfig = addressbook.server_config
+    clients, peers = await asyncio.to_thread(addressbook.federated_clients)
+    html = await render('clients.html', clients=clients, pasteconfig=pasteconfig or '',
+                        config_version=version, federated=True, peers=peers)
+    await respond(send, 200, html, "text/html; charset=utf-8")
+
+async def register_client(scope, receive, send):
+    """Register a new RustDesk client."""
+    source = client_address(scope)
+    length = content_length(scope)
+    if length is not None and length > addressbook.REGISTER_MAX_BYTES:
+        addressbook.count_metric("admission_too_large_total")
+        await respond_json(send, 413, {"status": "error", "message": f"Payload exceeds {addressbook.REGISTER_MAX_BYTES} bytes"})
+        return
+    retry_after = addressbook.take_rate_token(source)
+    if retry_after:
+        addressbook.count_metric("admission_rate_limited_total")
+        await respond_json(send, 429, {"status": "error", "message": "Rate limit exceeded"}, [("retry-after", str(retry_after))])
+        return
+
+    body = await read_body(receive, addressbook.REGISTER_MAX_BYTES)
+    if body is None:
+        addressbook.count_metric("admission_too_large_total")
+        await respond_json(send, 413, {"status": "error", "message": f"Payload exceeds {addressbook.REGISTER_MAX_BYTES} bytes"})
+        return
+    try:
+        data = json.loads(body)
+    except ValueError:
+        await respond_json(send, 400, {"status": "error", "message": "Invalid JSON"})
+        return
+    error = addressbook.registration_error(data)
+    if error:
+        await respond_json(send, 400, {"status": "error", "message": error})
+        return
+
+    now = datetime.now().isoformat()
+    outcome = await submit_write("register", source, data['client_id'],
+                                 lambda clients, index: addressbook.apply_registration(clients, index, data, source, now))
+    if outcome is None:
+        addressbook.count_metric("admission_overloaded_total")
+        await respond_json(send, 503, {"status": "error", "message": "Server busy"},
+                           [("retry-after", str(addressbook.OVERLOAD_RETRY_AFTER))])
+        return
+    addressbook.count_metric("admission_admitted_total")
+    saved, created = outcome
+    if not saved:
+        await respond_json(send, 500, {"status": "error", "message": "Failed to save client data"})
+    elif created:
+        await respond_json(send, 201, {"status": "success", "message": "Client registered"})
+    else:
+        await respond_json(send, 200, {"status": "success", "message": "Client updated"})
+
+async def update_notes(scope, receive, send):
+    """Update notes for a client."""
+    form = await read_form(receive)
+    if form is None:
+        await respond(send, 413, "Payload Too Large")
+        return
+    client_id = form.get('client_id')
+    notes = form.get('notes', '')
+    if not client_id:
+        await redirect_home(send, error="Client ID is required")
+        return
+
+    now = datetime.now().isoformat()
+    outcome = await submit_write("notes", client_address(scope), client_id,
+                                 lambda clients, index: addressbook.apply_notes(clients, client_id, notes, now))
+    if outcome is None:
+        await redirect_home(send, error="Server busy, try again")
+    elif not outcome[0]:
+        await redirect_home(send, error="Failed to save client data")
+    elif not outcome[1]:
+        await redirect_home(send, error="Client not found")
+    else:
+        await redirect_home(send)
+
+async def add_client(scope, receive, send):
+    """Add a client manually through a form."""
+    if scope["method"] == "GET":
+        await respond(send, 200, await render('add_client.html'), "text/html; charset=utf-8")
+        return
+
+    form = await read_form(receive)
+    if form is None:
+        await respond(send, 413, "Payload Too Large")
+        return
+    if not form.get('client_id') or not form.get('hostname'):
+        html = await render('add_client.html', error="Client ID and Hostname are required fields")
+        await respond(send, 200, html, "text/html; charset=utf-8")
+        return
+
+    now = datetime.now().isoformat()
+    outcome = await submit_write("add", client_address(scope), form['client_id'],
+                                 lambda clients, index: addressbook.upsert_client(clients, index, addressbook.manual_client(form, now), now))
+    if outcome is None or not outcome[0]:
+        html = await render('add_client.html', error="Failed to save client data")
+        await respond(send, 200, html, "text/html; charset=utf-8")
+        return
+    await redirect_home(send)
+
+async def delete_client(scope, receive, send, client_id):
+    """Delete a client from the registry."""
+    def delete(clients, index):
+        clients[:] = [c for c in clients if c["client_id"] != client_id]
+        index.clear()
+        index.update((c["client_id"], i) for i, c in enumerate(clients))
+
+    outcome = await submit_write("delete", client_address(scope), client_id, delete)
+    if outcome is None or not outcome[0]:
+        await redirect_home(send, error="Failed to delete client")
+        return
+    await redirect_home(send)
+
+async def bulk_form(scope, receive, send):
+    """Dashboard form for bulk actions."""
+    form = await read_form(receive)
+    if form is None:
+        await respond(send, 413, "Payload Too Large")
+        return
+    action = form.get('action')
+    value = form.get('value', '').strip()
+    if action not in addressbook.BULK_ACTIONS:
+        await redirect_home(send, error="Unsupported bulk action")
+        return
+    if action == 'tag' and not value:
+        await redirect_home(send, error="A tag value is required")
+        return
+    try:
+        matches = addressbook.build_client_filter(form)
+    except ValueError as e:
+        await redirect_home(send, error=str(e))
+        return
+
+    def bulk(clients, index):
+        affected = addressbook.bulk_update(clients, action, matches, value)
+        index.clear()
+        index.update((c["client_id"], i) for i, c in enumerate(clients))
+        return affected
+
+    outcome = await submit_write(f"bulk-{action}", client_address(scope), None, bulk)
+    if outcome is None:
+        await redirect_home(send, error="Server busy, try again")
+    elif not outcome[0]:
+        await redirect_home(send, error="Failed to save client data")
+    else:
+        await redirect_home(send, message=f"{action} applied to {len(outcome[1])} client(s)")
+
+async def config_events(scope, receive, send):
+    """Server-sent events that push the new paste config to dashboards when the key changes."""
+    try:
+        version = int(query_params(scope).get('version', addressbook.server_config[0]))
+    except ValueError:
+        version = addressbook.server_config[0]
+
+    async def wait_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache")]
+    })
+    disconnected = asyncio.ensure_future(wait_disconnect())
+    try:
+        while not disconnected.done():
+            current = addressbook.server_config
+            if current[0] != version:
+                version = current[0]
+                data = json.dumps({'version': version, 'pasteconfig': current[2] or ''})
+                await send({"type": "http.response.body", "body": f"event: config\ndata: {data}\n\n".encode(), "more_body": True})
+                continue
+            changed = asyncio.ensure_future(config_event.wait())
+            done, _ = await asyncio.wait({changed, disconnected}, timeout=addressbook.EVENT_KEEPALIVE,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            changed.cancel()
+            if not done:
+                await send({"type": "http.response.body", "body": b": keepalive\n\n", "more_body": True})
+    finally:
+        disconnected.cancel()
+
+ROUTES = [
+    ({"GET"}, re.compile(r"/"), client_list),
+    ({"GET"}, re.compile(r"/rustdesk_config\.txt"), get_key),
+    ({"GET"}, re.compile(r"/config"), client_config),
+    ({"GET"}, re.compile(r"/config/(?P<client_id>[^/]+)"), client_config_bundle),
+    ({"GET"}, re.compile(r"/api/export"), export_clients),
+    ({"GET"}, re.compile(r"/federation"), federation_list),
+    ({"POST"}, re.compile(r"/register"), register_client),
+    ({"GET", "POST"}, re.compile(r"/add"), add_client),
+    ({"POST"}, re.compile(r"/update-notes"), update_notes),
+    ({"POST"}, re.compile(r"/delete/(?P<client_id>[^/]+)"), delete_client),
+    ({"POST"}, re.compile(r"/bulk"), bulk_form),
+    ({"GET"}, re.compile(r"/events"), config_events),
+]
+
+class HeadersSent(Exception):
+    """Stops a GET handler serving a HEAD request once its headers are out."""
+
+async def head_request(handler, scope, receive, send, **params):
+    """Answer HEAD with a GET handler's status and headers and no body, as Flask does."""
+    async def send_headers_only(message):
+        if message["type"] != "http.response.start":
+            raise HeadersSent()
+        await send(message)
+        await send({"type": "http.response.body", "body": b""})
+    try:
+        await handler({**scope, "method": "GET"}, receive, send_headers_only, **params)
+    except HeadersSent:
+        pass
+
+async def startup():
+    global write_queue, config_event
+    loop = asyncio.get_running_loop()
+    write_queue = asyncio.Queue(WRITE_QUEUE_MAX)
+    config_event = asyncio.Event()
+    addressbook.config_listeners.append(lambda: loop.call_soon_threadsafe(signal_config_change))
+    task = asyncio.create_task(writer())
+    background_tasks.add(task)
+    addressbook.start_config_watcher()
+    addressbook.app.logger.info("Starting RustDesk Client Management Server (ASGI)")
+    # The listening socket is bound before startup, so connections already queue
+    addressbook.notify_systemd("READY=1")
+
+async def application(scope, receive, send):
+    """ASGI callable."""
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await startup()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
+
+    allowed = False
+    for methods, pattern, handler in ROUTES:
+        match = pattern.fullmatch(scope["path"])
+        if match is None:
+            continue
+        if scope["method"] == "HEAD" and "GET" in methods:
+            await head_request(handler, scope, receive, send, **match.groupdict())
+            return
+        if scope["method"] not in methods:
+            allowed = True
+            continue
+        await handler(scope, receive, send, **match.groupdict())
+        return
+    if allowed:
+        await respond(send, 405, "Method Not Allowed")
+    else:
+        await respond(send, 404, "Not Found")
+
+if __name__ == '__main__':
+    import uvicorn
+    addressbook.warm_start()
+    listener = socket.create_server(('0.0.0.0', httpportchangeme), backlog=2048)
+    uvicorn.Server(uvicorn.Config(application, backlog=2048)).run(sockets=[listener])